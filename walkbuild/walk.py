@@ -127,6 +127,30 @@ def system(
             )
 
 
+def system_check(
+        command,
+        walk_path,
+        force=None,
+        command_compare=None,
+        use_hash=True,
+        ):
+    '''
+    Returns `(doit, reason)` where `doit` is true iff `system()` with the same
+    args would run the command, and `reason` is text describing why. Does not
+    run the command.
+
+    For example this can be used to avoid acquiring an expensive resource that
+    is only needed if the command is run.
+    '''
+    return _system_check(
+            walk_path,
+            command,
+            command_compare,
+            force,
+            use_hash,
+            )
+
+
 class CommandFailed( Exception):
     '''
     Exception for a failed command.
@@ -496,6 +520,22 @@ def mtime( path, default=None):
     return t
 
 
+def ignore_path_prefix( prefix):
+    '''
+    Makes walk ignore files within directory `prefix` when recording and
+    checking the files that commands read and write.
+
+    For example this is useful for the cache directory of a command wrapper
+    such as `ccache`, which updates statistics and manifest files within its
+    cache directory on every invocation; otherwise these files would appear
+    as changed inputs and always force commands to be re-run.
+    '''
+    global _ignore_prefixes
+    prefix = os.path.join( os.path.abspath( prefix), '')
+    if prefix not in _ignore_prefixes:
+        _ignore_prefixes += prefix,
+
+
 def mtime_cache_mark_new( path):
     path = os.path.abspath( path)
     _mtime_cache[ path] = _mtime_new
@@ -507,6 +547,39 @@ def mtime_cache_mark_old( path):
     _mtime_cache[ path] = 0
 
 
+def mtime_cache_scan( root):
+    '''
+    Pre-populates the cache used by `walk.mtime()` with mtimes of all files
+    within directory `root`, using `os.scandir()` to walk the tree.
+
+    Each file is cached under both its path relative to `root` (as
+    `os.path.join( root, ...)`) and its absolute path, which is what
+    `walk.system()` uses when checking `.walk` files. Directories whose names
+    start with '.' (such as `.git/`) are not scanned. Existing cache entries,
+    for example from `mtime_cache_mark_new()`, are not changed.
+    '''
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            it = os.scandir( directory)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir( follow_symlinks=False):
+                        if not entry.name.startswith( '.'):
+                            directories.append( entry.path)
+                        continue
+                    t = entry.stat().st_mtime
+                except OSError:
+                    # E.g. broken softlink; leave it to walk.mtime().
+                    continue
+                _mtime_cache.setdefault( entry.path, t)
+                _mtime_cache.setdefault( os.path.abspath( entry.path), t)
+
+
 def get_verbose( v):
     '''
     Returns `v` or default verbose settings if `v` is `None`.
@@ -527,7 +600,8 @@ def file_write( text, path, verbose=None, force=None):
     '''
     verbose = get_verbose( verbose)
     try:
-        text0 = open( path).read()
+        with open( path) as f:
+            text0 = f.read()
     except OSError:
         text0 = None
     doit = text != text0
@@ -582,6 +656,7 @@ import time
 
 
 _force_new_files = set()
+_ignore_prefixes = ()
 _mtime_new = 3600*24*365*10*1000
 _mtime_cache = dict()
 _file_hash_cache = dict()
@@ -998,6 +1073,10 @@ def _system_check( walk_path, command, command_compare=None, force=None, use_has
                 # of command.
                 continue
 
+            if _ignore_prefixes and path.startswith( _ignore_prefixes):
+                # E.g. ccache's cache directory; see ignore_path_prefix().
+                continue
+
             # This gives a modest improvement in speed.
             #if path.startswith( '/usr/'):
             #    continue
@@ -1290,6 +1369,8 @@ class _WalkFile:
         if self.verbose:
             log( f'open: ret={ret} r={r} w={w} path={path}')
         path = os.path.abspath( path)
+        if _ignore_prefixes and path.startswith( _ignore_prefixes):
+            return
         _mtime_cache_clear( path)
         # Look for earlier mention of <path>.
         prev = self.path2info.get( path)
@@ -65,15 +65,31 @@ Details:
     So Flightgear can be run with::
     
         build-walk/fgfs.exe-run.sh --aircraft=... --airport=... ...
+    
+    We do not use `-MD`/`-MMD` dependency files. Walk runs each compile
+    command under strace/ktrace (or its preload library) and records in the
+    `.walk` file every file that the compiler opened, including all headers
+    that were included directly or indirectly. So when a header changes, we
+    only recompile source files whose previous compile actually read it.
 
 Args:
     -b
     --build
         Do a build.    
+    --ccache 0 | 1
+        If 1 and `ccache` is installed, we run compile commands via `ccache`.
+        We set `CCACHE_BASEDIR` to the current directory (unless already set)
+        so that builds in different directories can share cached results.
+        Default is 0.
     --clang 0 | 1
         If 1, we force use of clang instead of system compiler. Default is 0.
     --debug 0 | 1
         If 1 (default), we compile and link with `-g` to include debug symbols.    
+    --defines-header 0 | 1
+        If 1, instead of passing each source file's `-D` and `-U` flags on
+        the compile command line, we write them to a generated header
+        (one per distinct set of flags) and pass `-include <header>`. This
+        makes compile commands much shorter. Default is 0.
     --doctest
         Run doctest on this module.    
     --flags-all 0 | 1
@@ -93,24 +109,47 @@ Args:
         
         If 'default', commands are run only if necessary. This is also the
         default.    
+    --fast-ls 0 | 1
+        If 1, we find files known to git by reading `.git/index` directly
+        instead of running `git ls-files`, falling back to `git ls-files` if
+        the index uses a format that we don't handle. Default is 0.
     --fp 0 | 1
         If 1 we force use of frame pointer with
         `-fno-omit-frame-pointer`. Default is 0.
     --gperf 0 | 1
         If 1, build with support for google perf.    
+    --hash 0 | 1
+        If 1 (the default), Walk uses md5 hashes of a command's input files
+        (for compiles this includes every header that was read) to decide
+        whether to re-run it, so files that are touched without their
+        contents changing do not cause rebuilds. If 0, Walk uses mtimes.
     -h
     --help
         Show help.    
-    -j N
+    -j N | auto
         Set concurrency level - the maximum number of
         concurrent compiles. Default is derived from Python's
         `multiprocessing.cpu_count()`.
+        
+        If `auto`, we use the number of cpus minus the current load average,
+        so that we don't overload a machine that is already busy, and unless
+        `-l` is specified we use a max load average of the number of cpus
+        plus one.
     -l <maxload>
         Only schedule new concurrent commands when load average
         is less than `maxload`. Default is derived from Python's
         `multiprocessing.cpu_count()`.    
+    --link-jobs N
+        Maximum number of links that can run at the same time, across all
+        instances of this script run by the current user. This avoids running
+        out of memory when several builds finish at once. Default is one link
+        per 8GB of physical memory, but no more than the `-j` concurrency.
     --link-only
         Only do link, do not compile.    
+    --linker auto | default | mold | lld | gold
+        Set the linker, using the compiler's `-fuse-ld=...` option. If 'auto'
+        (the default), on Linux we use the first of mold, lld and gold that
+        is installed, falling back to the compiler's default linker.
     -n
         Don't run commands. Equivalent to '--force 0'.
     --new <path>
@@ -169,6 +208,12 @@ Args:
         Set the directory that will contain all generated files.
         
         Default is `build-walk/`.    
+    --pch 0 | 1
+        Experimental: if 1, we use precompiled headers. C++ files are grouped
+        by their compile flags, and for each large group we precompile a
+        generated header containing the standard library and OSG headers that
+        are included by most files in the group, and compile each file in the
+        group with `-include <header>`. Default is 0.
     --props-locking 0 | 1
         If 0, build with `SG_PROPS_UNTHREADSAFE` pre-defined.    
     -q
@@ -260,13 +305,26 @@ Requirements:
                     qtdeclarative \
 '''
 
+import concurrent.futures
+import fcntl
+import functools
 import glob
+import hashlib
 import inspect
 import io
+import itertools
+import json
+import linecache
+import math
 import multiprocessing
 import os
+import pickle
 import re
 import resource
+import shlex
+import shutil
+import stat
+import struct
 import subprocess
 import sys
 import textwrap
@@ -402,24 +460,28 @@ class LogPrefix:
 
 _log_prefix = LogPrefix()
 
-# Tell walk.log() to use _log_prefix as prefix for each line.
-walk.log_prefix_set( _log_prefix)
-
 
 g_build_debug = 1
 g_build_optimise = 1
+g_ccache = False
 g_clang = False
 g_concurrency = None
+g_defines_header = False
+g_fast_ls = False
 g_verbose = 0
 g_flags_all = False
 g_force = None
 g_keep_going = False
+g_link_concurrency = None
 g_link_only = False
+g_linker = 'auto'
 g_max_load_average = None
 g_osg = False   # If true, we build osg ourselves; does not yet work.
 g_osg_dir = None
+g_pch = False
 g_outdir = 'build-walk'
 g_gperf = 0
+g_use_hash = True
 g_show_timings = False
 g_walk_verbose = 'der'
 g_verbose_srcs = []
@@ -452,6 +514,7 @@ def system( command, walk_path, description=None, verbose=None):
             description=description,
             #out_prefix='    ',
             out=system_out,
+            use_hash=g_use_hash,
             )
     if e:
         raise Exception( f'command failed: {command}')
@@ -482,6 +545,26 @@ def system_concurrent(
             )
     return doit or g_force, reason, e
 
+def system_concurrent_bind( walk_concurrent, command_compare=None):
+    '''
+    Returns a function that behaves like `system_concurrent( walk_concurrent,
+    command, walk_path, description=None, command_compare=command_compare)`,
+    with our default verbose and force flags bound once. For use by loops that
+    enqueue many commands, so that we don't look these up for every command.
+    
+    Must be called after the `g_*` settings have been set.
+    '''
+    # We don't need system_concurrent()'s `doit or g_force` because
+    # walk_concurrent.system_r() always returns true `doit` if `g_force` is
+    # true.
+    return functools.partial(
+            walk_concurrent.system_r,
+            verbose=g_walk_verbose,
+            force=g_force,
+            command_compare=command_compare,
+            out=system_out,
+            )
+
 def file_write( text, path, verbose=None):
     '''
     Wrapper for `walk.file_write()` which uses `g_walk_verbose` and `g_force`.
@@ -491,39 +574,250 @@ def file_write( text, path, verbose=None):
     walk.file_write( text, path, verbose, g_force)
 
 
-def cmp(a, b):
+def cache_read( path, key):
+    '''
+    Returns the value stored by `cache_write( path, key, value)`. Returns None
+    if `path` does not exist, cannot be parsed, does not have the expected
+    layout or was written with a different `key`, so callers treat all of
+    these as a cache miss.
+    '''
+    try:
+        with open( path, 'rb') as f:
+            cache = pickle.load( f) if path.endswith( '.pickle') else json.load( f)
+        if cache['key'] == key:
+            return cache['value']
+    except Exception:
+        pass
+
+
+def cache_write( path, key, value):
+    '''
+    Writes `key` and `value` to cache file `path`, for use by `cache_read()`.
+    We use pickle if `path` ends with `.pickle`, otherwise json.
+
+    Like `walk.file_write()`, we write to a temporary file and rename, so
+    readers never see a partially-written file.
+    '''
+    os.makedirs( os.path.dirname( path) or '.', exist_ok=True)
+    cache = dict( key=key, value=value)
+    if path.endswith( '.pickle'):
+        with open( f'{path}-', 'wb') as f:
+            pickle.dump( cache, f)
+    else:
+        with open( f'{path}-', 'w') as f:
+            json.dump( cache, f, indent=4, sort_keys=True)
+    os.rename( f'{path}-', path)
+
+
+class LinkSlot:
+    '''
+    Context manager that limits the number of concurrent links across
+    processes.
+
+    We use `fcntl.flock()` on files `/tmp/walkfg-link-sem-<uid>/<i>` for `i`
+    in `range( n)`; `__enter__()` waits until it can lock one of these
+    files. The lock is released when the file is closed in `__exit__()`, or
+    by the kernel if we are killed.
+    
+    The files are in a directory that is only accessible by the current
+    user, and we never follow symlinks or truncate, so other users cannot
+    make us modify arbitrary files.
+    '''
+    def __init__( self, n):
+        self.n = max( 1, n)
+        self.fd = None
+    def _directory( self):
+        uid = os.getuid()
+        directory = f'/tmp/walkfg-link-sem-{uid}'
+        try:
+            os.mkdir( directory, 0o700)
+        except FileExistsError:
+            pass
+        st = os.lstat( directory)
+        if (0
+                or not stat.S_ISDIR( st.st_mode)
+                or st.st_uid != uid
+                or st.st_mode & 0o077
+                ):
+            raise Exception( f'Not using {directory} for link locks because it is not a private directory owned by us.')
+        return directory
+    def __enter__( self):
+        directory = self._directory()
+        it = 0
+        while 1:
+            for i in range( self.n):
+                fd = os.open( f'{directory}/{i}', os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+                try:
+                    fcntl.flock( fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close( fd)
+                    continue
+                self.fd = fd
+                return self
+            if it % 30 == 0:
+                walk.log( f'[Waiting for one of {self.n} link slot(s) to become free...]')
+            time.sleep( 1)
+            it += 1
+    def __exit__( self, type, value, tb):
+        os.close( self.fd)
+        self.fd = None
+
+
+def default_link_concurrency( concurrency):
+    '''
+    Returns default number of concurrent links: one per 8GB of physical
+    memory, but no more than `concurrency`.
+    '''
+    try:
+        ram = os.sysconf( 'SC_PAGE_SIZE') * os.sysconf( 'SC_PHYS_PAGES')
+    except ( ValueError, OSError):
+        return 1
+    return min( concurrency, max( 1, ram // 2**33))
+
+
+def gitfiles_cache_key( directory):
+    '''
+    Returns key for cached `git ls-files` output for `directory`, or `None`
+    if `directory` is not the top of a git checkout.
+    
+    The list of files known to git only changes when git updates
+    `.git/index`, so we use the mtimes of `.git/index` and `.git/HEAD`.
+    '''
+    try:
+        return (
+                os.stat( f'{directory}/.git/index').st_mtime_ns,
+                os.stat( f'{directory}/.git/HEAD').st_mtime_ns,
+                )
+    except OSError:
+        return None
+
+def gitfiles_cache_path( directory):
+    '''
+    Returns path of file containing cached `git ls-files` output for
+    `directory`.
+    '''
+    directory = directory.replace( '/', ',')
+    return f'{g_outdir}/.gitfiles-cache/{directory}.pickle'
+
+def read_git_index( directory):
     '''
-    Not sure why python3 dropped `cmp()`, but this recreates it.
+    Returns list of files in `<directory>/.git/index`, i.e. the same files
+    as `git ls-files`, or `None` if we don't handle the index format.
+    
+    We handle index versions 2 and 3 with SHA-1 object names. We return
+    `None` for other versions, for repositories using SHA-256, if `.git` is
+    not a directory (e.g. a worktree or submodule), and if the index has a
+    split-index ('link') or sparse-index ('sdir') extension.
     '''
-    return (a > b) - (a < b) 
+    git_dir = f'{directory}/.git'
+    if not os.path.isdir( git_dir):
+        return None
+    try:
+        with open( f'{git_dir}/config', 'rb') as f:
+            if b'objectformat' in f.read().lower():
+                return None
+        with open( f'{git_dir}/index', 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len( data) < 12 or data[:4] != b'DIRC':
+        return None
+    version, n = struct.unpack_from( '>II', data, 4)
+    if version not in (2, 3):
+        return None
+    prefix = directory + '/'
+    ret = []
+    pos = 12
+    for _ in range( n):
+        # Fixed-size part of entry is 62 bytes: ctime, mtime, dev, ino, mode,
+        # uid, gid, size, sha1, flags.
+        flags, = struct.unpack_from( '>H', data, pos + 60)
+        name_pos = pos + 62
+        if flags & 0x4000:
+            # Extended flags.
+            name_pos += 2
+        name_end = data.index( b'\0', name_pos)
+        ret.append( prefix + data[ name_pos : name_end].decode( 'latin-1'))
+        # Entries are padded with 1-8 nul bytes to a multiple of 8 bytes.
+        pos += (name_end - pos + 8) // 8 * 8
+    # Check extensions; signatures starting with a lowercase letter are ones
+    # that we must understand. The index ends with a 20-byte checksum.
+    while pos + 8 <= len( data) - 20:
+        signature = data[ pos : pos+4]
+        size, = struct.unpack_from( '>I', data, pos + 4)
+        if b'a' <= signature[:1] <= b'z':
+            return None
+        pos += 8 + size
+    return ret
 
+def get_gitfiles_start( directory):
+    '''
+    Starts finding files known to git in `directory`. Returns an item to be
+    passed to `get_gitfiles_finish()`.
+    
+    If we have cached output from a previous run of `git ls-files` which is
+    still valid, we use it. Otherwise we start running `git ls-files`; this
+    allows callers to run `git ls-files` in several directories
+    concurrently.
+    '''
+    key = gitfiles_cache_key( directory)
+    if key is not None:
+        files = cache_read( gitfiles_cache_path( directory), key)
+        if isinstance( files, list):
+            return key, files, None
+    if g_fast_ls:
+        files = read_git_index( directory)
+        if files is not None:
+            return key, files, None
+    child = subprocess.Popen(
+            ['git', '-C', directory, 'ls-files', '.'],
+            stdout=subprocess.PIPE,
+            )
+    return key, None, child
+
+def get_gitfiles_finish( directory, started):
+    '''
+    Returns list of files known to git in `directory`, where `started` was
+    returned by `get_gitfiles_start( directory)`.
+    '''
+    key, files, child = started
+    if files is not None:
+        return files
+    out, _ = child.communicate()
+    if child.returncode:
+        raise subprocess.CalledProcessError( child.returncode, child.args)
+    prefix = directory + '/'
+    files = [prefix + line.decode( 'latin-1') for line in out.splitlines() if line]
+    if key is not None:
+        cache_write( gitfiles_cache_path( directory), key, files)
+    return files
 
 def get_gitfiles( directory):
     '''
     Returns list of all files known to git in `directory`; `directory` must be
     somewhere within a git checkout.
     '''
-    command = 'cd ' + directory + '; git ls-files .'
-    text = subprocess.check_output( command, shell=True)
-    ret = []
-    text = text.decode('latin-1')
-    for f in text.split('\n'):
-        f = f.strip()
-        if not f:   continue
-        ret.append( os.path.join(directory, f))
-    return ret
+    return get_gitfiles_finish( directory, get_gitfiles_start( directory))
 
 def git_id( directory):
     '''
     Returns git sha.
     '''
-    id = subprocess.check_output( f'cd {directory} && PAGER= git show --pretty=oneline', shell=True)
+    id = subprocess.run(
+            ['git', '-C', directory, '--no-pager', 'show', '-s', '--pretty=oneline'],
+            stdout=subprocess.PIPE,
+            check=True,
+            ).stdout
     id = id.decode( 'latin-1')
     id = id.split( '\n', 1)[0]
     id = id.split( ' ', 1)[0]
     return id
 
 
+# Suffixes of source files that get_files() returns, for use with
+# str.endswith().
+_build_suffixes = ('.c', '.cpp', '.cxx')
+
 def get_files( target):
     '''
     Returns `(all, cpp)` where `all` is list of files known to git and `cpp` is
@@ -875,56 +1169,38 @@ def get_files( target):
                 'plib/*',
                 ]
     
-    # We sort <exclude_patterns> so that we can short-cut the searches we do
-    # below.
+    # Split <exclude_patterns> into a set of exact paths and a single regex
+    # that matches any of the prefix patterns, so that we check each path
+    # with one set lookup and one regex match.
     #
-    exclude_patterns.sort()
+    exclude_exact = frozenset( p for p in exclude_patterns if not p.endswith( '*'))
+    exclude_prefixes = [p[:-1] for p in exclude_patterns if p.endswith( '*')]
+    exclude_prefix_re = re.compile( '|'.join( re.escape( p) for p in exclude_prefixes)) if exclude_prefixes else None
 
-    files_flightgear = get_gitfiles( 'flightgear')
-    files_simgear = get_gitfiles( 'simgear')
-    files_plib = get_gitfiles( 'plib')
-    
-    files_osg = files_osg = get_gitfiles( 'openscenegraph') if g_osg else []
-
-    all_files = ([]
-            + files_flightgear
-            + files_simgear
-            + files_plib
-            + files_osg
-            )
-
-    ret = []
-    exclude_patterns_pos = 0
-    for path in all_files:
-        _, suffix = os.path.splitext( path)
-        if suffix not in ('.c', '.cpp', '.cxx'):
-            continue
-        include = True
-        for i, exclude_pattern in enumerate(exclude_patterns, exclude_patterns_pos):
-            if exclude_pattern.endswith( '*'):
-                if path.startswith( exclude_pattern[:-1]):
-                    if g_verbose_excludes:
-                        walk.log(f'Excluding {path=} because matches {exclude_pattern=}')
-                    include = False
-                    break
-            else:
-                c = cmp( exclude_pattern, path)
-                if c > 0:
-                    # <exclude_pattern> does not match <path>, and later
-                    # exclude patterns will also not match <path>.
-                    break
-                
-                # If we get here, <exclude_pattern> will not match later paths.
-                exclude_patterns_pos = i + 1
-                
-                # <exclude_pattern> matches <path>, so exclude <path>.
-                if c == 0:
-                    if g_verbose_excludes:
-                        walk.log(f'Excluding {path=} because matches {exclude_pattern=}')
-                    include = False
-                    break
-        if include:
-            ret.append( path)
+    # Run `git ls-files` in all directories concurrently.
+    #
+    directories = ['flightgear', 'simgear', 'plib']
+    if g_osg:
+        directories.append( 'openscenegraph')
+    started = [get_gitfiles_start( directory) for directory in directories]
+    files = [get_gitfiles_finish( d, s) for d, s in zip( directories, started)]
+    all_files = list( itertools.chain.from_iterable( files))
+
+    exclude_prefix_match = exclude_prefix_re.match if exclude_prefix_re else lambda path: None
+    ret = [
+            path
+            for path in all_files
+            if path.endswith( _build_suffixes)
+            and path not in exclude_exact
+            and not exclude_prefix_match( path)
+            ]
+    if g_verbose_excludes:
+        ret_set = set( ret)
+        for path in all_files:
+            if path.endswith( _build_suffixes) and path not in ret_set:
+                m = exclude_prefix_match( path)
+                exclude_pattern = m.group() + '*' if m else path
+                walk.log(f'Excluding {path=} because matches {exclude_pattern=}')
     
     if target == 'yasim-test':
         ret2 = [
@@ -968,11 +1244,55 @@ def get_files( target):
     return all_files, ret
 
 
-_cc_command_compare_regex = None
+_cc_command_compare_regex = re.compile(
+        r'(\s-Wno-\S+)'
+        r'|(\s-std=\S+)'
+        r'|(\s-fmax-errors=\S+)'
+        r'|(\s-fdiagnostics-\S+)'
+        r'|(\s-fmessage-length=\S+)'
+        ,
+        re.ASCII,
+        )
+
+def _cc_command_normalise( command):
+    '''
+    Returns `command` with flags that `cc_command_compare()` ignores removed,
+    and with redundant `-I`, `-isystem` and `-D` flags removed.
+    
+    We don't reorder flags because the order of include directories matters,
+    and later `-D` flags override earlier ones. So we only remove include
+    directories that have already been specified, and `-D` flags that would
+    not change the macro's current definition.
+    
+    >>> _cc_command_normalise( 'cc -I a -Ib -D X -I a -DX -DX=2 -DX -Wno-foo -o foo.o foo.c')
+    'cc -Ia -Ib -DX -DX=2 -DX -o foo.o foo.c'
+    '''
+    tokens = iter( _cc_command_compare_regex.sub( '', command).split())
+    ret = []
+    includes = set()
+    defines = dict()
+    for token in tokens:
+        if token in ('-I', '-D', '-U', '-isystem'):
+            token += next( tokens, '')
+        if token.startswith( ('-I', '-isystem')):
+            if token in includes:
+                continue
+            includes.add( token)
+        elif token.startswith( '-D'):
+            name = token[2:].split( '=', 1)[0]
+            if defines.get( name) == token:
+                continue
+            defines[ name] = token
+        elif token.startswith( '-U'):
+            defines.pop( token[2:], None)
+        ret.append( token)
+    return ' '.join( ret)
 
 def cc_command_compare( a, b):
     '''
-    Compares cc comamnds, ignoring differences in warning flags.
+    Compares cc comamnds, ignoring differences in warning and diagnostic
+    flags, and repeated include and define flags. Returns true if the commands
+    differ.
     
     >>> cc_command_compare( 'cc -o foo bar.c -Wno-xyz -Werror', 'cc -o foo bar.c -Wno-xyz -Werror')
     False
@@ -986,22 +1306,16 @@ def cc_command_compare( a, b):
     False
     >>> cc_command_compare( 'cc -o foo bar.c -fmax-errors=10 l', 'cc -o foo bar.c l')
     False
+    >>> cc_command_compare( 'cc -std=c++17 -o foo bar.c', 'cc -std=c++17 -o foo bar.c')
+    False
+    >>> cc_command_compare( 'cc -I a -D X -o foo bar.c', 'cc -Ia -DX -I a -fdiagnostics-color=always -o foo bar.c')
+    False
+    >>> cc_command_compare( 'cc -I a -I b -o foo bar.c', 'cc -I b -I a -o foo bar.c')
+    True
+    >>> cc_command_compare( 'cc -D X -o foo bar.c', 'cc -D X=2 -o foo bar.c')
+    True
     '''
-    global _cc_command_compare_regex
-    if _cc_command_compare_regex is None:
-        _cc_command_compare_regex = re.compile( '( -Wno-[^ ]+)|( -std=[^ ]+)|( -fmax-errors=[^ ]+)')
-    aa = re.sub( _cc_command_compare_regex, '', a)
-    bb = re.sub( _cc_command_compare_regex, '', b)
-    #print(f'aa={aa!r}')
-    #print(f'bb={bb!r}')
-    ret = aa != bb
-    ret0 = a != b
-    if not ret and ret0:
-        pass
-        #print( f'ignoring command diff:\n    {a}\n    {b}')
-    if ret and not ret0:
-        assert 0
-    return ret
+    return _cc_command_normalise( a) != _cc_command_normalise( b)
 
 
 class CompileFlags:
@@ -1010,6 +1324,9 @@ class CompileFlags:
     '''
     def __init__( self):
         self.items = []
+        self._prefix_index = None
+        self._flags_all = None
+        self._flags_cache = dict()
     
     def add( self, path_prefixes, flags, path_suffixes=None):
         '''
@@ -1026,33 +1343,120 @@ class CompileFlags:
         flags = flags.replace( ' -I ', ' -I')
         if isinstance( path_prefixes, str):
             path_prefixes = path_prefixes,
-        self.items.append( ( path_prefixes, path_suffixes, flags))
+        # We store tuples so that get_flags() can pass them directly to
+        # str.startswith() and str.endswith(), which then do all the
+        # comparisons in a single call. Many prefixes and flags are repeated
+        # in different items, so we intern them.
+        path_prefixes = tuple( sys.intern( p) for p in path_prefixes)
+        if path_suffixes:
+            path_suffixes = tuple( path_suffixes)
+        # Tokenise `flags` once here for use by get_flags_all(). Each token is
+        # `(flag, is_warning, flag_out)` where `flag_out` has '-DFOO' changed
+        # to '-D FOO' etc.
+        tokens = []
+        for flag in flags.split():
+            flag = sys.intern( flag)
+            is_warning = flag.startswith( '-W')
+            flag_out = flag
+            if not is_warning:
+                # Not sure why we do this.
+                for prefix in 'DI':
+                    if flag.startswith( '-'+prefix):
+                        flag_out = sys.intern( f'-{prefix} {flag[2:]}')
+            tokens.append( ( flag, is_warning, flag_out))
+        self.items.append( ( path_prefixes, path_suffixes, flags, tuple( tokens)))
+        self._prefix_index = None
+        self._flags_all = None
+        self._flags_cache = dict()
+    
+    def _prefix_matches( self, path):
+        '''
+        Returns sorted list of indices of items in `self.items` which have a
+        prefix that matches `path`.
+        
+        Instead of calling `path.startswith()` for every item, we use a dict
+        mapping from each prefix to the items that use it, and look up
+        `path[:n]` for each distinct prefix length `n`. The dict is created
+        lazily and discarded by `add()`.
+        '''
+        if self._prefix_index is None:
+            index = dict()
+            for i, (path_prefixes, _, _, _) in enumerate( self.items):
+                for prefix in path_prefixes:
+                    index.setdefault( prefix, set()).add( i)
+            lengths = sorted( set( len( prefix) for prefix in index))
+            self._prefix_index = index, lengths
+        index, lengths = self._prefix_index
+        ret = set()
+        for n in lengths:
+            if n > len( path):
+                break
+            items = index.get( path[:n])
+            if items:
+                ret.update( items)
+        return sorted( ret)
     
     def get_flags( self, path):
         '''
         Returns compile flags to use when compiling `path`.
         '''
+        indices = []
+        for i in self._prefix_matches( path):
+            path_suffixes = self.items[i][1]
+            if path_suffixes and not path.endswith( path_suffixes):
+                #walk.log( f'Excluding because does not match {path_suffixes=}: {path=}: {flags=}')
+                continue
+            indices.append( i)
+        # Only a small number of different combinations of items match, so we
+        # cache the resulting flags.
+        indices = tuple( indices)
+        ret = self._flags_cache.get( indices)
+        if ret is None:
+            ret = self._flags_dedup( indices)
+            self._flags_cache[ indices] = ret
+        return ret
+    
+    def _flags_dedup( self, indices):
+        '''
+        Returns concatenation of the flags of items in `indices`, omitting
+        `-I` flags that have already been specified and `-D` flags that
+        would not change the current definition of the macro.
+        
+        Items whose flags contain quotes are not tokenised, so are appended
+        unchanged; we forget about previous `-D` flags when this happens.
+        
+        >>> cf = CompileFlags()
+        >>> cf.add( 'a/', ' -I foo -D X -Wall')
+        >>> cf.add( 'a/b/', ' -I foo -I bar -D X -D Y=1')
+        >>> cf.add( 'a/b/c/', ' -D X=2 -D X -U Y -D Y=1')
+        >>> cf.get_flags( 'a/b/c/d.cpp')
+        ' -Ifoo -DX -Wall -Ibar -DY=1 -DX=2 -DX -U Y -DY=1'
+        >>> cf.get_flags( 'a/b/d.cpp')
+        ' -Ifoo -DX -Wall -Ibar -DY=1'
+        '''
         ret = ''
-        for path_prefixes, path_suffixes, flags in self.items:
-            for path_prefix in path_prefixes:
-                #walk.log( f'looking at path_prefix: {path_prefix}')
-                match = False
-                if path.startswith( path_prefix):
-                    if path_suffixes:
-                        for path_suffix in path_suffixes:
-                            if path.endswith( path_suffix):
-                                #walk.log( f'{path_suffix=} matches {path=}. {flags=}')
-                                match = True
-                                break
-                        else:
-                            #walk.log( f'Excluding because does not match {path_suffixes=}: {path=}: {flags=}')
-                            pass
-                    else:
-                        match = True
-                if match:
-                    #walk.log( f'adding flags: {flags}')
-                    ret += flags
-                    break
+        includes = set()
+        defines = dict()
+        for i in indices:
+            flags, tokens = self.items[i][2:4]
+            if '"' in flags or "'" in flags:
+                ret += flags
+                defines.clear()
+                continue
+            for flag, _, _ in tokens:
+                if flag.startswith( '-I'):
+                    if flag in includes:
+                        continue
+                    includes.add( flag)
+                elif flag in ( '-D', '-U'):
+                    # Macro name is in the next token.
+                    defines.clear()
+                elif flag.startswith( ( '-D', '-U')):
+                    name = flag[2:].split( '=', 1)[0]
+                    if defines.get( name) == flag:
+                        continue
+                    defines[ name] = flag
+                ret += f' {flag}'
         return ret
     
     def get_flags_all( self, path):
@@ -1061,33 +1465,26 @@ class CompileFlags:
         (except for warning flags which are still calculated specifically for
         `path`).
         '''
-        ret_flags = set()
-        ret = ''
-        ret_warnings = ''
-        for path_prefixes, flags in self.items:
-            match = False
-            for path_prefix in path_prefixes:
-                if path.startswith( path_prefix):
-                    match = True
-                    break
-            for flag in flags.split():
-                flag = flag.strip()
-                if flag in ret_flags:
-                    continue
-                is_warning = flag.startswith( '-W')
+        # The union of non-warning flags does not depend on `path`, so we
+        # only calculate it once.
+        if self._flags_all is None:
+            flags_all = dict()
+            for _, _, _, tokens in self.items:
+                for flag, is_warning, flag_out in tokens:
+                    if not is_warning:
+                        flags_all.setdefault( flag, flag_out)
+            self._flags_all = list( flags_all.values())
+        ret = list( self._flags_all)
+        ret_warnings = dict()
+        for i in self._prefix_matches( path):
+            _, path_suffixes, _, tokens = self.items[i]
+            if path_suffixes and not path.endswith( path_suffixes):
+                continue
+            for flag, is_warning, _ in tokens:
                 if is_warning:
-                    if match:
-                        ret_flags.add( flag)
-                        ret_warnings += f' {flag}'
-                else:
-                    # Change '-DFOO' to '-D FOO' etc. Not sure why we do this.
-                    ret_flags.add( flag)
-                    for prefix in 'DI':
-                        if flag.startswith( '-'+prefix):
-                            flag = f'-{prefix} {flag[2:]}'
-                    ret += f' {flag}'
-                    
-        return ret + ret_warnings
+                    ret_warnings[ flag] = None
+        ret += ret_warnings
+        return ' ' + ' '.join( ret) if ret else ''
 
 
 def make_compile_flags( libs_cflags, cpp_feature_defines):
@@ -1100,6 +1497,9 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
     '''     
     cf = CompileFlags()
     
+    # Directory containing generated headers and source files.
+    walk_generated = f'{g_outdir}/walk-generated'
+    
     cf.add( ('openscenegraph/'),
             ' -DOSG_LIBRARY -Dosg_EXPORTS -I openscenegraph/include -isystem /usr/X11R6/include -Wno-deprecated-copy',
             )
@@ -1306,7 +1706,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             f'{g_outdir}/flightgear/',
              'simgear/',
             f'{g_outdir}/simgear/',
-            f'{g_outdir}/walk-generated/flightgear/',
+            f'{walk_generated}/flightgear/',
             ),
             cpp_feature_defines
             )
@@ -1317,7 +1717,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             ),
              ' -I simgear'
              ' -I flightgear/src'
-            f' -I {g_outdir}/walk-generated'
+            f' -I {walk_generated}'
              ' -D ENABLE_AUDIO_SUPPORT'
             )
 
@@ -1394,7 +1794,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             f'flightgear/src/GUI/',
             f'{g_outdir}/flightgear/src/GUI/',
             ),
-            f' -I {g_outdir}/walk-generated/Include'
+            f' -I {walk_generated}/Include'
             f' -I flightgear/3rdparty/fonts'
             f' -I {g_outdir}/flightgear/src/GUI'
             )
@@ -1406,7 +1806,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             )
 
     cf.add( 'flightgear/3rdparty/fonts/',
-            f' -I {g_outdir}/walk-generated/plib-include'
+            f' -I {walk_generated}/plib-include'
             )
 
     cf.add( 'flightgear/3rdparty/hidapi/',
@@ -1415,8 +1815,8 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
 
     cf.add( 'flightgear/src/Instrumentation/HUD/',
             ' -I flightgear/3rdparty/fonts'
-            f' -I {g_outdir}/walk-generated/plib-include'
-            f' -I {g_outdir}/walk-generated/plib-include/plib'
+            f' -I {walk_generated}/plib-include'
+            f' -I {walk_generated}/plib-include/plib'
             )
 
 
@@ -1427,7 +1827,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
 
     cf.add( 'flightgear/src/Main/',
             ' -I flightgear'
-            f' -I {g_outdir}/walk-generated/Include'
+            f' -I {walk_generated}/Include'
             )
 
     cf.add( 'flightgear/src/MultiPlayer',
@@ -1440,7 +1840,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
 
     cf.add('flightgear/src/Network',
             ' -I flightgear'
-            f' -I {g_outdir}/walk-generated/Include'
+            f' -I {walk_generated}/Include'
             )
     
     cf.add( 'flightgear/src/Scripting/ClipboardX11.cxx',
@@ -1472,8 +1872,8 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             ' -I simgear'
             ' -I simgear/simgear/canvas/ShivaVG/include'
             ' -I simgear/3rdparty/udns'
-            f' -I {g_outdir}/walk-generated'
-            f' -I {g_outdir}/walk-generated/simgear'
+            f' -I {walk_generated}'
+            f' -I {walk_generated}/simgear'
             )
 
     cf.add( (
@@ -1537,7 +1937,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             ' -I plib/src/ssg'
             )
 
-    cf.add( f'{g_outdir}/walk-generated/EmbeddedResources',
+    cf.add( f'{walk_generated}/EmbeddedResources',
             ' -I simgear'
             )
 
@@ -1567,8 +1967,8 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             'flightgear/src/Model/',
             'flightgear/src/Viewer/',
             ),
-            f' -I {g_outdir}/walk-generated/plib-include'
-            + f' -I {g_outdir}/walk-generated/plib-include/plib'
+            f' -I {walk_generated}/plib-include'
+            + f' -I {walk_generated}/plib-include/plib'
             )
     
     # Cmake build puts FG_HAVE_GPERFTOOLS in config.h, but this requires
@@ -1600,7 +2000,7 @@ def make_compile_flags( libs_cflags, cpp_feature_defines):
             'flightgear/test_suite/simgear_tests/math',
             ),
             ' -I flightgear/src/FDM/JSBSim'
-            f' -I {g_outdir}/walk-generated/plib-include'
+            f' -I {walk_generated}/plib-include'
             )
     
     cf.add( (
@@ -1736,7 +2136,69 @@ class Timings:
         return ret
 
 
-def do_compile(target, walk_concurrent, cc_base, cpp_base, cf, path, preprocess=False, force=None):
+@functools.lru_cache( maxsize=None)
+def compile_template(
+        base,
+        preprocess,
+        test_suite,
+        optimise,
+        clang,
+        build_debug,
+        frame_pointer,
+        osg_dir,
+        flags_all,
+        props_locking,
+        ):
+    '''
+    Returns `(command_head, command_tail, path_o_suffix)` for use by
+    `do_compile()`. The compile command is `command_head` + per-file flags +
+    `command_tail` + output and input paths, and the output path is
+    `<outdir>/<path>` + `path_o_suffix` + extension.
+    
+    These only depend on our args, which are the build settings, so we cache
+    them instead of rebuilding them for every file.
+    '''
+    command = [base]
+    path_o = []
+    
+    if preprocess:
+        command.append( ' -E')
+    else:
+        command.append( ' -c')
+
+    if test_suite:
+        # Most .o files are identical to a fgfs build.
+        path_o.append( ',test-suite')
+        command.append( ' -D BUILDING_TESTSUITE')
+
+    if clang:
+        path_o.append( ',clang')
+    if build_debug:
+        command.append( ' -g -gsplit-dwarf')
+        path_o.append( ',debug')
+    if frame_pointer:
+        command.append( ' -fno-omit-frame-pointer')
+        path_o.append( ',fp')
+    if optimise:
+        command.append( ' -O3 -msse2 -mfpmath=sse -ftree-vectorize -ftree-slp-vectorize')
+        path_o.append( ',opt')
+
+    if osg_dir:
+        path_o.append( ',osg')
+        command.append( f' -I {osg_dir}/include')
+
+    if flags_all:
+        path_o.append( ',flags-all')
+    
+    command_tail = []
+    if not props_locking:
+        path_o.append( ',sgunsafe')
+        command_tail.append( ' -D SG_PROPS_UNTHREADSAFE')
+
+    return ''.join( command), ''.join( command_tail), ''.join( path_o)
+
+
+def do_compile(target, walk_concurrent, cc_base, cpp_base, cf, path, preprocess=False, force=None, system_r=None):
     '''
     Schedules compile of `path` (if necessary). Returns name of `.o` file.
     
@@ -1757,122 +2219,246 @@ def do_compile(target, walk_concurrent, cc_base, cpp_base, cf, path, preprocess=
             Source file to compile.
         preprocess
             If true, generate preprocessed output, don't compile.
-    '''
-    assert isinstance( cf, CompileFlags)
+        system_r
+            If not None, a function returned by
+            `system_concurrent_bind( walk_concurrent, cc_command_compare)` to
+            use instead of `system_concurrent()`.
     
-    if path.endswith( '.c'):
-        command = cc_base
-    else:
-        command = cpp_base
+    When compiling many files, use `compile_function()` instead.
+    '''
+    fn = compile_function(
+            target,
+            walk_concurrent,
+            cc_base,
+            cpp_base,
+            cf,
+            preprocess,
+            system_r,
+            )
+    return fn( path)
 
-    if preprocess:
-        command += ' -E'
-    else:
-        command += ' -c'
 
-    path_o = f'{g_outdir}/{path}'
+def defines_header( flags, headers):
+    '''
+    Returns `flags` with `-D` and `-U` flags replaced by `-include` of a
+    generated header containing equivalent `#define` and `#undef` lines.
+    
+    flags:
+        Compile flags, as returned by `CompileFlags.get_flags()`.
+    headers:
+        Dict used to remember headers that we have already written, so we
+        only write each header once.
+    '''
+    ret = headers.get( flags)
+    if ret is None:
+        lines = []
+        others = []
+        tokens = iter( shlex.split( flags))
+        for token in tokens:
+            if token in ('-D', '-U'):
+                token += next( tokens)
+            if token.startswith( '-D'):
+                name, eq, value = token[2:].partition( '=')
+                lines.append( f'#define {name} {value if eq else 1}\n')
+            elif token.startswith( '-U'):
+                lines.append( f'#undef {token[2:]}\n')
+            else:
+                others.append( token)
+        if lines:
+            text = ''.join( lines)
+            name = hashlib.sha1( text.encode()).hexdigest()[:16]
+            path = f'{g_outdir}/walk-generated/defines/{name}.h'
+            file_write( text, path)
+            others += ['-include', path]
+        ret = ' ' + shlex.join( others) if others else ''
+        headers[ flags] = ret
+    return ret
+
 
+def compile_function(target, walk_concurrent, cc_base, cpp_base, cf, preprocess=False, system_r=None, pch_paths=None):
+    '''
+    Returns a function `fn( path)` that behaves like `do_compile( target,
+    walk_concurrent, cc_base, cpp_base, cf, path, preprocess,
+    system_r=system_r)`.
+    
+    The build settings are looked up once here, and the returned function
+    only does the work that depends on `path`.
+    
+    If `g_pch` is true and `pch_paths` is a list of the source files that
+    will be compiled, we first build precompiled headers for them with
+    `pch_build()` and wait for these to complete.
+    '''
+    assert isinstance( cf, CompileFlags)
+    
+    if system_r is None:
+        system_r = functools.partial(
+                system_concurrent,
+                walk_concurrent,
+                command_compare=cc_command_compare,
+                )
+    get_flags = cf.get_flags_all if g_flags_all else cf.get_flags
+    if g_defines_header:
+        get_flags_raw = get_flags
+        headers = dict()
+        def get_flags( path):
+            return defines_header( get_flags_raw( path), headers)
+    outdir = g_outdir
+    build_optimise = g_build_optimise
+    optimise_prefixes = list( g_optimise_prefixes)
+    link_only = g_link_only
+    verbose_srcs = set( g_verbose_srcs)
     if target == 'test-suite':
         # Most .o files are identical to a fgfs build.
-        if path in (
+        test_suite_paths = (
                 #'flightgear/src/Airports/airport.cxx',
                 'flightgear/src/Main/sentryIntegration.cxx',
                 'flightgear/src/Scripting/NasalSys.cxx',
-                ):
-            path_o += ',test-suite'
-            command += ' -D BUILDING_TESTSUITE'
-
-    if g_clang:
-        path_o += ',clang'
-    if g_build_debug:
-        command += ' -g -gsplit-dwarf'
-        path_o += ',debug'
-    if g_frame_pointer:
-        command += ' -fno-omit-frame-pointer'
-        path_o += ',fp'
-    
-    optimise = g_build_optimise
-    for o, prefix in g_optimise_prefixes:
-        #walk.log( f'o={o!r} prefix={prefix!r}')
-        if path.startswith( prefix):
-            walk.log( f'Forcing optimise={o} for path={path}')
-            optimise = o
-    if optimise:
-        command += ' -O3 -msse2 -mfpmath=sse -ftree-vectorize -ftree-slp-vectorize'
-        path_o += ',opt'
-    if 0 and g_build_optimise:
-        # Allow selected files to be compiled without optimisation to
-        # help debugging.
-        if path in [
-                #'flightgear/src/AIModel/AIMultiplayer.cxx',
-                #'flightgear/src/Aircraft/controls.cxx',
-                #'flightgear/src/Aircraft/replay.cxx',
-                #'flightgear/src/Autopilot/pidcontroller.cxx',
-                #'flightgear/src/FDM/YASim/ControlMap.cpp',
-                #'flightgear/src/FDM/YASim/FGFDM.cpp',
-                #'flightgear/src/GUI/FGPUIDialog.cxx',
-                #'flightgear/src/GUI/FGPUIMenuBar.cxx',
-                #'flightgear/src/Main/locale.cxx',
-                #'flightgear/src/Main/options.cxx',
-                #'flightgear/src/Network/fgcom.cxx',
-                #'flightgear/src/Time/TimeManager.cxx',
-                #'flightgear/src/Viewer/fg_os_osgviewer.cxx',
-                #'flightgear/src/Viewer/renderer.cxx',
-                #'flightgear/src/Viewer/sview.cxx',
-                #'flightgear/src/Viewer/viewmgr.cxx',
-                #'simgear/simgear/props/props.cxx',
-                #'simgear/simgear/props/props.cxx',
-                #'simgear/simgear/props/props.cxx',
-                #'simgear/simgear/scene/model/particles.cxx',
-                #'simgear/simgear/scene/viewer/CompositorPass.cxx',                
-                #'simgear/simgear/screen/video-encoder.cxx',
-                #'flightgear/src/FDM/YASim/Gear.cpp',
-                ]:
-            walk.log(f'*** not optimising {path}')
-            command += ' -ggdb'
-        else:
-            command += ' -O3 -msse2 -mfpmath=sse -ftree-vectorize -ftree-slp-vectorize'
-            path_o += ',opt'
-
-    if g_osg_dir:
-        path_o += ',osg'
-        command += f' -I {g_osg_dir}/include'
-
-    if g_flags_all:
-        path_o += ',flags-all'
-        command = command + cf.get_flags_all( path)
+                )
     else:
-        command = command + cf.get_flags( path)
+        test_suite_paths = ()
     
-    if not g_props_locking:
-        path_o += ',sgunsafe'
-        command = command + ' -D SG_PROPS_UNTHREADSAFE'
-
-    if preprocess:
-        path_o += os.path.splitext( path)[1]
-    else:
-        path_o += '.o'
-
-    if g_link_only:
-        doit = False
-        reason = None
-        e = None
-    else:
-        command += f' -o {path_o} {path}'
-        if path in g_verbose_srcs:
+    # Most of the command and .o path only depend on the build settings, so we
+    # get them from compile_template(), keyed by the things that can vary
+    # between files.
+    #
+    templates = dict()
+    def template( is_c, test_suite, optimise):
+        return compile_template(
+                cc_base if is_c else cpp_base,
+                preprocess,
+                test_suite,
+                optimise,
+                g_clang,
+                g_build_debug,
+                g_frame_pointer,
+                g_osg_dir,
+                g_flags_all,
+                g_props_locking,
+                )
+    
+    def command_prefix( path):
+        # Returns `(command_prefix, path_o_suffix)`, where the compile command
+        # is `command_prefix` + output and input paths.
+        optimise = build_optimise
+        for o, prefix in optimise_prefixes:
+            #walk.log( f'o={o!r} prefix={prefix!r}')
+            if path.startswith( prefix):
+                walk.log( f'Forcing optimise={o} for path={path}')
+                optimise = o
+        
+        key = path.endswith( '.c'), path in test_suite_paths, optimise
+        t = templates.get( key)
+        if t is None:
+            t = templates[ key] = template( *key)
+        command_head, command_tail, path_o_suffix = t
+        return f'{command_head}{get_flags( path)}{command_tail}', path_o_suffix
+    
+    pch_headers = dict()
+    if g_pch and pch_paths and not preprocess and not link_only:
+        pch_headers = pch_build( pch_paths, command_prefix, system_r, walk_concurrent)
+    
+    def fn( path):
+        command_prefix_, path_o_suffix = command_prefix( path)
+        
+        if preprocess:
+            path_o = f'{outdir}/{path}{path_o_suffix}{os.path.splitext( path)[1]}'
+        else:
+            path_o = f'{outdir}/{path}{path_o_suffix}.o'
+        
+        if link_only:
+            return path_o, False, None, None
+        
+        pch_header = pch_headers.get( command_prefix_)
+        if pch_header:
+            command_prefix_ += f' -include {pch_header} -Winvalid-pch'
+        command = f'{command_prefix_} -o {path_o} {path}'
+        if path in verbose_srcs:
             walk.log(f'command is: {command}')
 
         # Tell walk to schedule running of the compile command if necessary.
         #
-        doit, reason, e = system_concurrent(
-                walk_concurrent,
+        doit, reason, e = system_r(
                 command,
                 f'{path_o}.walk',
                 description=f'Compiling to {path_o}',
-                command_compare=cc_command_compare,
                 )
+        return path_o, doit, reason, e
     
-    return path_o, doit, reason, e
+    return fn
+
+
+# Matches `#include <...>` lines.
+_include_angle_regex = re.compile( rb'^[ \t]*#[ \t]*include[ \t]*<([^>]+)>', re.M)
+
+# Matches headers that we put into precompiled headers: standard library
+# headers such as `<vector>` and OSG headers such as `<osg/Node>`, which are
+# self-contained and don't depend on macros defined by the including file.
+_pch_include_regex = re.compile( '[a-z_]+|osg[A-Za-z]*/[A-Za-z_]+')
+
+def pch_build( paths, command_prefix, system_r, walk_concurrent, min_group=8):
+    '''
+    Builds precompiled headers for C++ files in `paths`. Returns dict mapping
+    from compile command prefix to the header that compiles with this prefix
+    should pass with `-include`.
+    
+    paths:
+        Source files that will be compiled.
+    command_prefix:
+        Function taking a path and returning `(command_prefix,
+        path_o_suffix)`. A precompiled header can only be used by compiles
+        with exactly the same flags, so we group files by `command_prefix`.
+    system_r:
+        Function for running commands, as in `compile_function()`.
+    walk_concurrent:
+        The walk.Concurrent instance used by `system_r`; we wait for it to
+        finish running the precompile commands.
+    min_group:
+        Groups with fewer files than this do not get a precompiled header.
+    
+    For each group we generate a header containing the headers (see
+    `_pch_include_regex`) that are included by at least half of the files
+    in the group, and precompile it using walk, so that it is only rebuilt
+    when necessary. gcc and clang automatically use `<header>.gch` or
+    `<header>.pch` when a file is compiled with `-include <header>`.
+    '''
+    groups = dict()
+    for path in paths:
+        if path.endswith( ( '.cpp', '.cxx', '.cc')):
+            prefix, _ = command_prefix( path)
+            groups.setdefault( prefix, []).append( path)
+    
+    ret = dict()
+    for prefix, group in groups.items():
+        if len( group) < min_group:
+            continue
+        counts = dict()
+        for path in group:
+            with open( path, 'rb') as f:
+                text = f.read()
+            includes = set( m.group(1).decode( 'latin-1') for m in _include_angle_regex.finditer( text))
+            for include in includes:
+                if _pch_include_regex.fullmatch( include):
+                    counts[ include] = counts.get( include, 0) + 1
+        includes = sorted( i for i, n in counts.items() if 2 * n >= len( group))
+        if not includes:
+            continue
+        text = f'// Precompiled header for {len( group)} files.\n'
+        text += ''.join( f'#include <{i}>\n' for i in includes)
+        name = hashlib.sha1( prefix.encode()).hexdigest()[:16]
+        header = f'{g_outdir}/walk-generated/pch/{name}.h'
+        file_write( text, header)
+        header_pch = f'{header}.pch' if g_clang else f'{header}.gch'
+        system_r(
+                f'{prefix} -x c++-header {header} -o {header_pch}',
+                f'{header_pch}.walk',
+                description=f'Precompiling header for {len( group)} files: {header}',
+                )
+        ret[ prefix] = header
+    
+    walk_concurrent.join()
+    if ret:
+        walk.log( f'Using {len( ret)} precompiled header(s).')
+    return ret
 
 
 def cc_version(cc):
@@ -1913,6 +2499,120 @@ def compilers_base():
     return cc_base, cpp_base
 
 
+def ccache_prefix():
+    '''
+    Returns 'ccache ' if `g_ccache` is true and `ccache` is installed,
+    otherwise ''. Also sets up `ccache`'s environment variables.
+    '''
+    if not g_ccache:
+        return ''
+    if not shutil.which( 'ccache'):
+        walk.log( f'Warning: not using ccache because it is not installed.')
+        return ''
+    # Make ccache use relative paths within the current directory, so that
+    # absolute paths don't prevent cache hits, and check compilers by content
+    # instead of mtime.
+    os.environ.setdefault( 'CCACHE_BASEDIR', os.getcwd())
+    os.environ.setdefault( 'CCACHE_COMPILERCHECK', 'content')
+    # walk traces ccache itself, so would otherwise record the files that
+    # ccache reads in its cache directory as inputs. Some of these, such as
+    # statistics files, change on every compile, which would make walk
+    # re-run commands unnecessarily.
+    for directory in ccache_directories():
+        walk.ignore_path_prefix( directory)
+    return 'ccache '
+
+
+def ccache_directories():
+    '''
+    Returns list of directories that `ccache` might use for its cache, both
+    as specified and with symlinks resolved.
+    '''
+    try:
+        directory = subprocess.run(
+                ['ccache', '-k', 'cache_dir'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+                ).stdout.decode( 'utf-8').strip()
+        directories = [directory] if directory else []
+    except Exception:
+        # Older ccache without `-k`, so use its default locations.
+        directories = []
+    if not directories:
+        home = os.path.expanduser( '~')
+        directories = [
+                os.environ.get( 'CCACHE_DIR'),
+                f'{os.environ.get( "XDG_CACHE_HOME") or f"{home}/.cache"}/ccache',
+                f'{home}/.ccache',
+                ]
+        directories = [d for d in directories if d]
+    ret = []
+    for directory in directories:
+        for d in directory, os.path.realpath( directory):
+            if d not in ret:
+                ret.append( d)
+    return ret
+
+
+_cpp_features_regex = re.compile( rb'check_cxx_source_compiles[(]"([^"]*)" ([A-Z_]+)', re.M)
+
+def linker_flags( cpp_base):
+    '''
+    Returns flags to add to the link command to select the linker specified
+    by `g_linker`.
+    '''
+    linker = g_linker
+    if linker == 'auto':
+        linker = 'default'
+        if g_linux:
+            # Minimum gcc version that supports -fuse-ld=<linker>.
+            gcc_min = dict( mold=12, lld=9)
+            gcc_version = None
+            for l in 'mold', 'lld', 'gold':
+                if not shutil.which( f'ld.{l}'):
+                    continue
+                # Check for the linker first, because cc_version() has to run
+                # the compiler.
+                if l in gcc_min and not g_clang:
+                    if gcc_version is None:
+                        gcc_version = int( cc_version( cpp_base)[0])
+                    if gcc_version < gcc_min[ l]:
+                        continue
+                linker = l
+                break
+    if linker == 'default':
+        return ''
+    ret = f' -fuse-ld={linker}'
+    if g_build_debug:
+        # Create .gdb_index section now, so gdb starts up quickly.
+        ret += ' -Wl,--gdb-index'
+    return ret
+
+
+def get_cpp_predefined_macros( cpp_base):
+    '''
+    Returns set of names of macros that are predefined by C++ compiler
+    `cpp_base`, using a single `-dM -E` invocation. Returns empty set if the
+    compiler fails.
+    '''
+    try:
+        text = subprocess.run(
+                shlex.split( cpp_base) + ['-dM', '-E', '-x', 'c++', '/dev/null'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+                ).stdout.decode( 'latin-1')
+    except Exception:
+        return set()
+    ret = set()
+    for line in text.split( '\n'):
+        words = line.split( None, 2)
+        if len( words) >= 2 and words[0] == '#define':
+            ret.add( words[1].split( '(')[0])
+    return ret
+
+
 def get_cpp_feature_defines( timings, cpp_base):
     '''
     Returns string containing list of `-D` options, from running tests
@@ -1922,37 +2622,120 @@ def get_cpp_feature_defines( timings, cpp_base):
     if g_openbsd:
         path = 'simgear/CMakeModules/CheckCXXFeatures.cmake'
         timings.begin( 'cpp-features', f'Running tests from {path}.')
-        with open( path) as f:
+        with open( path, 'rb') as f:
             text = f.read()
-        for m in re.finditer('check_cxx_source_compiles[(]"([^"]*)" ([A-Z_]+)', text, re.M):
-            code = m.group(1)
-            define = m.group(2)
+        tests = [
+                (m.group(1).decode( 'utf-8'), m.group(2).decode( 'ascii'))
+                for m in _cpp_features_regex.finditer( text)
+                ]
+        
+        # We cache results in a json file, keyed on a hash of the compiler
+        # command, compiler version and test code.
+        cache_path = f'{g_outdir}/feature-cache.json'
+        cache = cache_read( cache_path, None)
+        if not isinstance( cache, dict):
+            cache = dict()
+        cpp_version = '.'.join( cc_version( cpp_base))
+        def key( code):
+            return hashlib.sha1( f'{cpp_base}\n{cpp_version}\n{code}'.encode()).hexdigest()
+        
+        def run_test( i):
+            code, define = tests[i]
             if g_verbose >= 3:
                 walk.log( f'Testing for {define}')
-            with open( f'{g_outdir}/test.cpp', 'w') as f:
+            test_path = f'{g_outdir}/test-{i}.cpp'
+            with open( test_path, 'w') as f:
                 f.write(code)
-            e = os.system( f'{cpp_base} -o /dev/null {g_outdir}/test.cpp 1>/dev/null 2>/dev/null')
-            if e == 0:
+            e = os.system( f'{cpp_base} -o /dev/null {test_path} 1>/dev/null 2>/dev/null')
+            return e == 0
+        
+        # Run tests that are not in the cache concurrently. First we ask the
+        # compiler for its predefined macros, and assume success without
+        # running a test if the define it would set is already present.
+        todo = [i for i, (code, define) in enumerate( tests) if key( code) not in cache]
+        if todo:
+            os.makedirs( g_outdir, exist_ok=True)
+            predefined = get_cpp_predefined_macros( cpp_base)
+            for i in todo:
+                code, define = tests[i]
+                if define in predefined:
+                    if g_verbose >= 3:
+                        walk.log( f'{define} is predefined by compiler')
+                    cache[ key( code)] = True
+            todo = [i for i in todo if key( tests[i][0]) not in cache]
+            with concurrent.futures.ThreadPoolExecutor( multiprocessing.cpu_count()) as executor:
+                for i, ok in zip( todo, executor.map( run_test, todo)):
+                    cache[ key( tests[i][0])] = ok
+            cache_write( cache_path, None, cache)
+        
+        for code, define in tests:
+            if cache[ key( code)]:
                 if g_verbose >= 2:
                     walk.log( f'defining     {define}')
                 cpp_feature_defines += f' -D {define}'
             else:
                 if g_verbose >= 2:
                     walk.log( f'not defining {define}')
-                pass
         timings.end( 'cpp-features')
     return cpp_feature_defines
 
 
-def get_lib_flags():
+def pkg_config_cache_key( libs):
     '''
-    Returns `(libs, libs_cflags, libs_linkflags)`:
-        libs
-            List of libraries we should link with.
-        libs_cflags
-            Compile flags from `pkg-config` for `libs`.
-        libs_linkflags
-            Link flags from `pkg-config` for `libs`.
+    Returns key for cached `pkg-config` output for `libs`.
+    
+    Installing or removing packages adds, removes or replaces `.pc` files,
+    which changes the mtime of the directory containing them, so we use the
+    mtimes of the directories that `pkg-config` searches, as given by
+    `PKG_CONFIG_PATH`, `PKG_CONFIG_LIBDIR` and `pkg-config`'s own default
+    search path. We also include the environment variables that change
+    `pkg-config`'s output.
+    '''
+    environ = [
+            os.environ.get( name)
+            for name in ( 'PKG_CONFIG_PATH', 'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_SYSROOT_DIR')
+            ]
+    directories = []
+    for name in 'PKG_CONFIG_PATH', 'PKG_CONFIG_LIBDIR':
+        directories += os.environ.get( name, '').split( ':')
+    try:
+        pc_path = subprocess.run(
+                'pkg-config --variable pc_path pkg-config',
+                shell=1,
+                check=1,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=1,
+                ).stdout
+        directories += pc_path.strip().split( ':')
+    except Exception:
+        # Fall back to the usual default search path.
+        for prefix in ( '/usr', '/usr/local', '/usr/X11R6'):
+            directories += glob.glob( f'{prefix}/lib/*/pkgconfig')
+            directories += [
+                    f'{prefix}/lib/pkgconfig',
+                    f'{prefix}/lib64/pkgconfig',
+                    f'{prefix}/share/pkgconfig',
+                    ]
+    mtimes = []
+    for directory in directories:
+        try:
+            mtimes.append( os.stat( directory).st_mtime_ns)
+        except OSError:
+            mtimes.append( None)
+    return [libs, environ, directories, mtimes]
+
+
+def get_lib_flags_start():
+    '''
+    Starts running `pkg-config` to find compile and link flags. Returns an
+    item to be passed to `get_lib_flags_finish()`.
+    
+    This allows callers to do other work, such as running `git ls-files`,
+    while `pkg-config` runs.
+    
+    If we have cached output from a previous run of `pkg-config` which is
+    still valid, we use it instead.
     '''
     # Libraries for which we call pkg-config:
     #
@@ -1984,11 +2767,57 @@ def get_lib_flags():
                 ' speexdsp'
                 )
     
-    libs_cflags     = ' ' + subprocess.check_output( f'pkg-config --cflags {libs}', shell=1).decode( 'latin-1').strip()
-    libs_linkflags  = ' ' + subprocess.check_output( f'pkg-config --libs {libs}', shell=1).decode( 'latin-1').strip()
+    key = pkg_config_cache_key( libs)
+    flags = cache_read( f'{g_outdir}/pkgconfig-cache.json', key)
+    if (1
+            and isinstance( flags, list)
+            and len( flags) == 2
+            and all( isinstance( f, str) for f in flags)
+            ):
+        return libs, key, flags
+    
+    children = [
+            subprocess.Popen( f'pkg-config {flag} {libs}', shell=1, stdout=subprocess.PIPE)
+            for flag in ('--cflags', '--libs')
+            ]
+    return libs, key, children
+
+
+def get_lib_flags_finish( started):
+    '''
+    Returns `(libs, libs_cflags, libs_linkflags)`, where `started` was
+    returned by `get_lib_flags_start()`:
+        libs
+            List of libraries we should link with.
+        libs_cflags
+            Compile flags from `pkg-config` for `libs`.
+        libs_linkflags
+            Link flags from `pkg-config` for `libs`.
+    '''
+    libs, key, children = started
+    if isinstance( children[0], str):
+        # Cached output.
+        flags = children
+    else:
+        flags = []
+        for child in children:
+            text, _ = child.communicate()
+            if child.returncode:
+                raise subprocess.CalledProcessError( child.returncode, child.args)
+            flags.append( ' ' + text.decode( 'latin-1').strip())
+        cache_write( f'{g_outdir}/pkgconfig-cache.json', key, flags)
+    libs_cflags, libs_linkflags = flags
     return libs, libs_cflags, libs_linkflags
 
 
+def get_lib_flags():
+    '''
+    Returns `(libs, libs_cflags, libs_linkflags)`; see
+    `get_lib_flags_finish()`.
+    '''
+    return get_lib_flags_finish( get_lib_flags_start())
+
+
 def preprocess( timings, target, path, walk_=None):
     '''
     Preprocess `path`, writing to `<target>.c` or `<target>.cpp`.
@@ -2011,6 +2840,92 @@ def preprocess( timings, target, path, walk_=None):
             preprocess=True,
             )
 
+
+# Matches `#include "foo.moc"` lines. We read files in binary mode, so we
+# allow for '\r\n' line endings.
+_moc_include_regex = re.compile( rb'\n#include ".*[.]moc"\r?\n')
+
+def moc_scan( path):
+    '''
+    Returns 'header' if `path` is a header that uses `Q_OBJECT`, 'source' if
+    `path` is a C++ source file that includes a `.moc` file, otherwise None.
+    '''
+    ext = os.path.splitext( path)[1]
+    if ext in ('.h', '.hxx', '.hpp'):
+        with open( path, 'rb') as f:
+            text = f.read()
+        if b'Q_OBJECT' in text:
+            return 'header'
+    elif ext in ('.cpp', '.cxx'):
+        with open( path, 'rb') as f:
+            text = f.read()
+        # Check for '.moc"' before using the regex, because few files contain
+        # it.
+        if b'.moc"' in text and _moc_include_regex.search( text):
+            return 'source'
+
+
+def moc_scan_all( paths, concurrency):
+    '''
+    Returns list of `moc_scan(path)` for each item in `paths`.
+    
+    We cache results in `{g_outdir}/moc-scan-cache.json`, keyed on each
+    file's mtime and size, so on an incremental build we usually only need to
+    stat the files. Files that need scanning are read in a thread pool so that
+    reads overlap.
+    '''
+    cache_path = f'{g_outdir}/moc-scan-cache.json'
+    cache = cache_read( cache_path, None)
+    if not isinstance( cache, dict):
+        cache = dict()
+    ret = [None] * len( paths)
+    keys = [None] * len( paths)
+    todo = []
+    for i, path in enumerate( paths):
+        try:
+            st = os.stat( path)
+        except OSError:
+            todo.append( i)
+            continue
+        keys[i] = [st.st_mtime_ns, st.st_size]
+        item = cache.get( path)
+        if isinstance( item, list) and len( item) == 3 and item[:2] == keys[i]:
+            ret[i] = item[2]
+        else:
+            todo.append( i)
+    if todo:
+        with concurrent.futures.ThreadPoolExecutor( concurrency) as executor:
+            for i, needed in zip( todo, executor.map( moc_scan, [paths[i] for i in todo])):
+                ret[i] = needed
+        cache = dict()
+        for path, key, needed in zip( paths, keys, ret):
+            if key:
+                cache[ path] = key + [needed]
+        cache_write( cache_path, None, cache)
+    return ret
+
+
+def symlink_force( target, link):
+    '''
+    Makes `link` a softlink to `target`, like `ln -sf`. We create a new
+    softlink and rename it over any existing file, so `link` always exists.
+    
+    Does nothing if `link` is already a softlink to `target`.
+    '''
+    try:
+        if os.readlink( link) == target:
+            return
+    except OSError:
+        pass
+    link_temp = f'{link}-walk-temp'
+    try:
+        os.remove( link_temp)
+    except FileNotFoundError:
+        pass
+    os.symlink( target, link_temp)
+    os.replace( link_temp, link)
+
+
 def build( timings, target):
     '''
     Builds `target` using `g_*` settings.
@@ -2025,6 +2940,9 @@ def build( timings, target):
     '''
     timings.begin( 'all', f'Building target={target}.', 2)
     
+    # Directory containing generated headers and source files.
+    walk_generated = f'{g_outdir}/walk-generated'
+    
     timings.begin( 'pre')
     if g_openbsd:
         # clang needs around 2G to compile
@@ -2040,6 +2958,9 @@ def build( timings, target):
             if g_verbose >= 2:
                 walk.log( f'Have changed RLIMIT_DATA from {soft} to {soft_new}.')
 
+    # Run pkg-config in the background while we find source files.
+    lib_flags_started = get_lib_flags_start()
+    
     timings.begin( 'get_files', 'Finding git source files.')
     all_files, src_fgfs = get_files( target)
     timings.end( 'get_files')
@@ -2049,7 +2970,7 @@ def build( timings, target):
             or target == 'yasim-test'
             or target.startswith( 'simgear/')
             ):
-        pass
+        walk_codegen = None
     else:
         
         # Run various commands to patch source code or run moc etc. We use
@@ -2073,36 +2994,49 @@ def build( timings, target):
 
         # Generate .moc files. We look for files containing Q_OBJECT.
         #
+        # We run moc, rcc and uic commands concurrently using a separate
+        # walk.Concurrent instance. We don't wait for them to finish until
+        # just before we look at source mtimes, so they run in parallel with
+        # the plib softlinks, feature checks and finding of linker flags.
+        #
+        codegen_concurrency = g_concurrency
+        if not isinstance( codegen_concurrency, int):
+            codegen_concurrency = multiprocessing.cpu_count()
+        walk_codegen = walk.Concurrent(
+                codegen_concurrency,
+                keep_going=g_keep_going,
+                use_hash=g_use_hash,
+                )
+        
         timings.begin( 'moc', 'Generating Moc files.')
         moc = 'moc'
         if g_openbsd:
             moc = 'moc-qt5'
-        for i in all_files:
-            if i.startswith( 'flightgear/src/GUI/') or i.startswith( 'flightgear/src/Viewer/'):
-                i_base, ext = os.path.splitext( i)
-                if ext in ('.h', '.hxx', '.hpp'):
-                    with open( i) as f:
-                        text = f.read()
-                    if 'Q_OBJECT' in text:
-                        cpp_file = f'{g_outdir}/{i}.moc.cpp'
-                        system(
-                                f'{moc} {i} -o {cpp_file}',
-                                f'{cpp_file}.walk',
-                                f'Running moc on {i}',
-                                )
-                        src_fgfs.append( cpp_file)
-                elif ext in ('.cpp', '.cxx'):
-                    #walk.log( f'checking {i}')
-                    with open( i) as f:
-                        text = f.read()
-                    if re.search( '\n#include ".*[.]moc"\n', text):
-                        #walk.log( f'running moc on: {i}')
-                        moc_file = f'{g_outdir}/{i_base}.moc'
-                        system(
-                                f'{moc} {i} -o {moc_file}',
-                                f'{moc_file}.walk',
-                                f'Running moc on {i}',
-                                )
+        moc_candidates = [
+                i for i in all_files
+                if i.startswith( ('flightgear/src/GUI/', 'flightgear/src/Viewer/'))
+                ]
+        moc_needed = moc_scan_all( moc_candidates, codegen_concurrency or 1)
+        for i, needed in zip( moc_candidates, moc_needed):
+            if needed == 'header':
+                cpp_file = f'{g_outdir}/{i}.moc.cpp'
+                system_concurrent(
+                        walk_codegen,
+                        f'{moc} {i} -o {cpp_file}',
+                        f'{cpp_file}.walk',
+                        f'Running moc on {i}',
+                        )
+                src_fgfs.append( cpp_file)
+            elif needed == 'source':
+                #walk.log( f'running moc on: {i}')
+                i_base, _ = os.path.splitext( i)
+                moc_file = f'{g_outdir}/{i_base}.moc'
+                system_concurrent(
+                        walk_codegen,
+                        f'{moc} {i} -o {moc_file}',
+                        f'{moc_file}.walk',
+                        f'Running moc on {i}',
+                        )
         timings.end( 'moc')
 
         # Create various header files. We use our file_write() which ensure
@@ -2113,7 +3047,8 @@ def build( timings, target):
         # Create flightgear's config.h file.
         #
         timings.begin( 'config', 'Generating misc headers/source files.')
-        fg_version = open('flightgear/flightgear-version').read().strip()
+        with open( 'flightgear/flightgear-version', 'rb') as f:
+            fg_version = f.read().strip().decode( 'ascii')
         fg_version_major, fg_version_minor, fg_version_tail = fg_version.split('.')
         root = os.path.abspath( '.')
 
@@ -2196,7 +3131,7 @@ def build( timings, target):
                 #define SENTRY_API_KEY ""
                 '''
                 ),
-                f'{g_outdir}/walk-generated/config.h',
+                f'{walk_generated}/config.h',
                 )
 
 
@@ -2211,14 +3146,14 @@ def build( timings, target):
                 #define HAVE_STD_INDEX_SEQUENCE 1
                 ''')
                 ,
-                f'{g_outdir}/walk-generated/simgear/simgear_config.h',
+                f'{walk_generated}/simgear/simgear_config.h',
                 )
 
         # Create various other headers.
         #
         file_write(
                 f'#define FLIGHTGEAR_VERSION "{fg_version}"\n',
-                f'{g_outdir}/walk-generated/Include/version.h',
+                f'{walk_generated}/Include/version.h',
                 )
 
         git_id_text = git_id( 'flightgear').replace('"', '\\"')
@@ -2228,16 +3163,16 @@ def build( timings, target):
         revision += f'#define REVISION "{git_id_text}"\n'
         file_write(
                 revision,
-                f'{g_outdir}/walk-generated/Include/build.h',
+                f'{walk_generated}/Include/build.h',
                 )
         file_write(
                 revision,
-                f'{g_outdir}/walk-generated/Include/flightgearBuildId.h',
+                f'{walk_generated}/Include/flightgearBuildId.h',
                 )
 
         file_write(
                 '#pragma once\n' + 'void initFlightGearEmbeddedResources();\n',
-                f'{g_outdir}/walk-generated/EmbeddedResources/FlightGear-resources.hxx',
+                f'{walk_generated}/EmbeddedResources/FlightGear-resources.hxx',
                 )
 
         # Generate FlightGear-resources.cxx.
@@ -2270,33 +3205,36 @@ def build( timings, target):
                 }
                 ''')
                 ,
-                f'{g_outdir}/walk-generated/EmbeddedResources/FlightGear-resources.cxx',
+                f'{walk_generated}/EmbeddedResources/FlightGear-resources.cxx',
                 )
 
         # When we generate C++ source files (not headers), we need to add them to
         # src_fgfs so they get compiled into the final executable.
         #
 
-        src_fgfs.append( f'{g_outdir}/walk-generated/EmbeddedResources/FlightGear-resources.cxx')
+        src_fgfs.append( f'{walk_generated}/EmbeddedResources/FlightGear-resources.cxx')
 
-        simgear_version = open('simgear/simgear-version').read().strip()
+        with open( 'simgear/simgear-version', 'rb') as f:
+            simgear_version = f.read().strip().decode( 'ascii')
         file_write(
                 f'#define SIMGEAR_VERSION {simgear_version}\n',
-                f'{g_outdir}/walk-generated/simgear/version.h',
+                f'{walk_generated}/simgear/version.h',
                 )
         timings.end( 'config')
 
         timings.begin( 'rcc/uic', 'Generating Qt resources with rcc/uic.')
         rcc_in = f'flightgear/src/GUI/resources.qrc'
-        rcc_out = f'{g_outdir}/walk-generated/flightgear/src/GUI/qrc_resources.cpp'
+        rcc_out = f'{walk_generated}/flightgear/src/GUI/qrc_resources.cpp'
         if g_openbsd:
-            system(
+            system_concurrent(
+                    walk_codegen,
                     f'/usr/local/lib/qt5/bin/rcc -name resources -o {rcc_out} {rcc_in}',
                     f'{rcc_out}.walk',
                     f'Running rcc on {rcc_in}',
                     )
         else:
-            system(
+            system_concurrent(
+                    walk_codegen,
                     f'/usr/lib/qt5/bin/rcc --name resources --output {rcc_out} {rcc_in}',
                     f'{rcc_out}.walk',
                     f'Running rcc on {rcc_in}',
@@ -2306,41 +3244,46 @@ def build( timings, target):
         uic = 'uic'
         if g_openbsd:
             uic = '/usr/local/lib/qt5/bin/uic'
-        system(
-                f'{uic} -o {g_outdir}/walk-generated/Include/ui_InstallSceneryDialog.h'
+        system_concurrent(
+                walk_codegen,
+                f'{uic} -o {walk_generated}/Include/ui_InstallSceneryDialog.h'
                     f' flightgear/src/GUI/InstallSceneryDialog.ui'
                     ,
-                f'{g_outdir}/walk-generated/Include/ui_InstallSceneryDialog.h.walk',
+                f'{walk_generated}/Include/ui_InstallSceneryDialog.h.walk',
                 f'Running uic on flightgear/src/GUI/InstallSceneryDialog.ui',
                 )
 
-        e = system(
-                f'{uic} -o {g_outdir}/walk-generated/ui_SetupRootDialog.h'
+        system_concurrent(
+                walk_codegen,
+                f'{uic} -o {walk_generated}/ui_SetupRootDialog.h'
                     f' flightgear/src/GUI/SetupRootDialog.ui'
                     ,
-                f'{g_outdir}/walk-generated/ui_SetupRootDialog.h.walk',
+                f'{walk_generated}/ui_SetupRootDialog.h.walk',
                 f'Running uic on flightgear/src/GUI/SetupRootDialog.ui',
                 )
         timings.end( 'rcc/uic')
-
+        
         # Set up softlinks that look like a plib install - some code requires plib
         # installation header tree.
         #
         timings.begin( 'plib-install', 'Setting up softlinks for plib install.')
-        def find( root, leaf):
-            for dirpath, dirnames, filenames in os.walk( root):
-                if leaf in filenames:
-                    return os.path.join( dirpath, leaf)
-            assert 0
-
-        dirname = f'{g_outdir}/walk-generated/plib-include/plib'
-        command = f'mkdir -p {dirname}; cd {dirname}'
-        for leaf in 'pw.h pu.h sg.h netSocket.h js.h ssg.h puAux.h sl.h sm.h sl.h psl.h ul.h pw.h ssgAux.h ssgaSky.h fnt.h ssgaBillboards.h net.h ssgMSFSPalette.h ulRTTI.h puGLUT.h'.split():
-            path = find( 'plib/src', leaf)
+        leaves = 'pw.h pu.h sg.h netSocket.h js.h ssg.h puAux.h sl.h sm.h sl.h psl.h ul.h pw.h ssgAux.h ssgaSky.h fnt.h ssgaBillboards.h net.h ssgMSFSPalette.h ulRTTI.h puGLUT.h'.split()
+        
+        # Find all leaves in a single walk of plib/src, using the first match
+        # for each leaf.
+        leaf_to_path = dict()
+        for dirpath, dirnames, filenames in os.walk( 'plib/src'):
+            for leaf in filenames:
+                if leaf in leaves and leaf not in leaf_to_path:
+                    leaf_to_path[ leaf] = os.path.abspath( os.path.join( dirpath, leaf))
+
+        dirname = f'{walk_generated}/plib-include/plib'
+        os.makedirs( dirname, exist_ok=True)
+        for leaf in leaves:
+            path = leaf_to_path[ leaf]
             #walk.log(f'plib path: {path}')
-            path = os.path.abspath( path)
-            command += f' && ln -sf {path} {leaf}'
-        os.system( command)
+            link = f'{dirname}/{leaf}'
+            symlink_force( path, link)
         timings.end( 'plib-install')
     
     cc_base, cpp_base = compilers_base()
@@ -2360,6 +3303,7 @@ def build( timings, target):
     #
     link_command = cpp_base
     link_command += ' -rdynamic'    # So backtrace() and backtrace_symbols() see symbols.
+    link_command += linker_flags( cpp_base)
     
     if target == 'fgfs':
         exe = f'{g_outdir}/fgfs'
@@ -2401,7 +3345,7 @@ def build( timings, target):
         walk.log( f'Executable is: {exe}')
 
     timings.begin( 'link-flags', 'Finding linker flags.')
-    libs, libs_cflags, libs_linkflags = get_lib_flags()
+    libs, libs_cflags, libs_linkflags = get_lib_flags_finish( lib_flags_started)
     
     if 0:
         # Show linker information.
@@ -2517,11 +3461,42 @@ def build( timings, target):
     link_command_files = []
     timings.end( 'link-flags')
 
+    if walk_codegen:
+        # Generated files must be complete before we read mtimes, otherwise
+        # walk's mtime cache could end up with out-of-date information.
+        timings.begin( 'codegen-wait', 'Waiting for moc/rcc/uic commands.')
+        walk_codegen.join()
+        errors = walk_codegen.get_errors()
+        walk_codegen.end()
+        if errors:
+            raise Exception( f'{len( errors)} moc/rcc/uic command(s) failed.')
+        timings.end( 'codegen-wait')
+    
+    timings.begin( 'mtime-scan', 'Reading mtimes of source trees.')
+    # Populate walk's mtime cache in one pass over each source tree, instead
+    # of a separate os.stat() for each path when sorting below and when
+    # walk checks .walk files.
+    #
+    for root in ( 'flightgear', 'simgear', 'plib'):
+        walk.mtime_cache_scan( root)
+    if g_osg:
+        walk.mtime_cache_scan( 'openscenegraph')
+    timings.end( 'mtime-scan')
+
     timings.begin( 'source-sort', 'Sorting source files by mtime.')
     # Sort the source files by mtime so that we compile recently-modified ones
     # first, which helps save time when investigating/fixing compile failures.
     #
-    src_fgfs.sort( key=lambda path: -walk.mtime( path))
+    # We look up each mtime once, up front. Files that don't exist, such as
+    # generated files that have not been created yet, are treated as newest.
+    # We don't pass a default to walk.mtime() because it would store it in
+    # walk's mtime cache.
+    #
+    mtimes = dict()
+    for path in src_fgfs:
+        t = walk.mtime( path)
+        mtimes[ path] = math.inf if t is None else t
+    src_fgfs.sort( key=mtimes.__getitem__, reverse=True)
     timings.end( 'source-sort')
     
     timings.end( 'pre')
@@ -2535,14 +3510,27 @@ def build( timings, target):
         concurrency = multiprocessing.cpu_count()
         if g_verbose >= 0:
             walk.log( f'Using default concurrency of {concurrency}.')
+    elif concurrency == 'auto':
+        cpu_count = multiprocessing.cpu_count()
+        concurrency = max( 1, cpu_count - int( os.getloadavg()[0]))
+        if max_load_average is None:
+            max_load_average = cpu_count + 1
+        if g_verbose >= 0:
+            walk.log( f'Using auto concurrency of {concurrency} with {cpu_count=}.')
     if max_load_average is None:
         max_load_average = concurrency * 2
         if g_verbose >= 0:
             walk.log( f'Using default max load average of {max_load_average}.')
+    link_concurrency = g_link_concurrency
+    if link_concurrency is None:
+        link_concurrency = default_link_concurrency( concurrency)
+        if g_verbose >= 0:
+            walk.log( f'Using default link concurrency of {link_concurrency}.')
     walk_concurrent = walk.Concurrent(
             concurrency,
             max_load_average=max_load_average,
             keep_going=g_keep_going,
+            use_hash=g_use_hash,
             )
     timings.end( 'walk.Concurrent')
     
@@ -2561,33 +3549,39 @@ def build( timings, target):
         walk._log_last_t = 0    # Ensure we output 0% diagnostic for first file we look at.
 
         num_compiles_queued = 0
-        for i, path in enumerate( src_fgfs):
+        ccache = ccache_prefix()
+        compile_ = compile_function(
+                target,
+                walk_concurrent,
+                ccache + cc_base,
+                ccache + cpp_base,
+                cf,
+                system_r=system_concurrent_bind( walk_concurrent, cc_command_compare),
+                pch_paths=src_fgfs,
+                )
         
-            def get_progress():
-                # We blend i/len(src_fgfs) with
-                # walk_concurrent.num_commands_run / num_compiles_to_run.
+        # get_progress() is only called when we output diagnostics, and uses
+        # the current values of `i` and `num_compiles_queued`.
+        i = 0
+        def get_progress():
+            # We blend i/len(src_fgfs) with
+            # walk_concurrent.num_commands_run / num_compiles_to_run.
+            if num_compiles_queued:
+                p = walk_concurrent.num_commands_run / (num_compiles_queued * len(src_fgfs)/i)
+            else:
                 p = i / len(src_fgfs)
-                if num_compiles_queued:
-                    p = walk_concurrent.num_commands_run / (num_compiles_queued * len(src_fgfs)/i)
-                else:
-                    p = i / len(src_fgfs)
-                return p
-            _log_prefix.progress = get_progress
-                      
-            if g_verbose >= 0:
+            return p
+        _log_prefix.progress = get_progress
+        
+        for i, path in enumerate( src_fgfs):
+            # Only check whether to output a diagnostic every few files, to
+            # avoid the overhead of formatting text for every file.
+            if g_verbose >= 0 and i % 16 == 0:
                 walk.log_ping( f'Looking at: {path}', 4)
-            path_o, doit, reason, e = do_compile(
-                    target,
-                    walk_concurrent,
-                    cc_base,
-                    cpp_base,
-                    cf,
-                    path,
-                    force=False,
-                    )
+            path_o, doit, reason, e = compile_( path)
             if doit:
                 num_compiles_queued += 1
-            link_command_files.append( f' {path_o}')
+            link_command_files.append( path_o)
 
         timings.end( 'compile-enqueing')
         
@@ -2609,49 +3603,79 @@ def build( timings, target):
         if g_verbose >= 0:
             walk.log( f'Number of compiles run was {walk_concurrent.num_commands_run}/{walk_concurrent.num_commands}.')
         
+        # file_write() writes to a temporary file and renames, so the linker
+        # never sees a partially-written file, and leaves the file untouched
+        # if the list of .o files is unchanged.
+        #
         link_command_files.sort()
-        link_command_files = '\n'.join( link_command_files)
-        file_write( link_command_files, link_command_extra_path)
+        file_write( '\n'.join( link_command_files) + '\n', link_command_extra_path)
         
         #link_command += ' -Wl,--verbose'
 
-        # Tell walk to run our link command if necessary.
+        # Create scripts to run our generated executable. These do not depend
+        # on the link, so we write them in a separate thread while the linker
+        # runs.
         #
-        timings.begin( 'link', 'Linking.')
-        if g_force or g_force is None:
-            system( link_command, f'{exe}.walk', description=f'Linking {exe}')
-        if g_verbose >= 0:
-            walk.log( f'{"Executable:":20s}{exe}')
-        timings.end( 'link')
-
-        # Create scripts to run our generated executable.
-        #
-        timings.begin( 'create-wrapper', f'Creating wrapper scripts for {exe}.')
-        for gdb in '', '-gdb':
-            script_path = f'{exe}-run{gdb}.sh'
-            text = '#!/bin/sh\n'
+        def write_wrapper_scripts():
+            ld_library_path = ''
             if g_osg_dir:
                 l = find1(
                         f'{g_osg_dir}/lib',
                         f'{g_osg_dir}/lib64',
                         )
-                text += f'LD_LIBRARY_PATH={l} '
-            if gdb:
-                text += 'egdb' if g_openbsd else 'gdb'
-                text += ' -ex "handle SIGPIPE noprint nostop"'
-                text += ' -ex "handle SIG32 noprint nostop"'
-                text += ' -ex "set print thread-events off"'
-                text += ' -ex "set print pretty on"'
-                #text += ' -ex "catch throw"'
-                text += ' -ex run'
-                text += f' --args '
-            else:
-                text += 'exec '
-            text += f'{exe} "$@"\n'
+                ld_library_path = f'LD_LIBRARY_PATH={l} '
+            script_paths = []
+            for gdb in '', '-gdb':
+                script_path = f'{exe}-run{gdb}.sh'
+                text = '#!/bin/sh\n'
+                text += ld_library_path
+                if gdb:
+                    text += 'egdb' if g_openbsd else 'gdb'
+                    text += ' -ex "handle SIGPIPE noprint nostop"'
+                    text += ' -ex "handle SIG32 noprint nostop"'
+                    text += ' -ex "set print thread-events off"'
+                    text += ' -ex "set print pretty on"'
+                    #text += ' -ex "catch throw"'
+                    text += ' -ex run'
+                    text += f' --args '
+                else:
+                    text += 'exec '
+                text += f'{exe} "$@"\n'
+                if g_force or g_force is None:
+                    file_write( text, script_path)
+                    # Usually the script is unchanged and already executable,
+                    # in which case we avoid any writes.
+                    mode = os.stat( script_path).st_mode
+                    if not mode & 0o100:
+                        os.chmod( script_path, mode | 0o100)
+                script_paths.append( script_path)
+            return script_paths
+        
+        with concurrent.futures.ThreadPoolExecutor( 1) as executor:
+            wrapper_scripts = executor.submit( write_wrapper_scripts)
+            
+            # Tell walk to run our link command if necessary.
+            #
+            timings.begin( 'link', 'Linking.')
             if g_force or g_force is None:
-                file_write( text, script_path)
-                os.system( f'chmod u+x {script_path}')
+                # Only wait for a link slot if the link will actually run, so
+                # that no-op builds don't wait for other builds' links. We
+                # still let system() check again after we have a slot.
+                #
+                doit, _ = walk.system_check( link_command, f'{exe}.walk', force=g_force, use_hash=g_use_hash)
+                if doit:
+                    with LinkSlot( link_concurrency):
+                        system( link_command, f'{exe}.walk', description=f'Linking {exe}')
+                else:
+                    system( link_command, f'{exe}.walk', description=f'Linking {exe}')
             if g_verbose >= 0:
+                walk.log( f'{"Executable:":20s}{exe}')
+            timings.end( 'link')
+            
+            timings.begin( 'create-wrapper', f'Creating wrapper scripts for {exe}.')
+            script_paths = wrapper_scripts.result()
+        if g_verbose >= 0:
+            for script_path in script_paths:
                 walk.log( f'{"Wrapper script:":20s}{script_path}')
         
         # Make softlinks to most recent build called:
@@ -2669,7 +3693,7 @@ def build( timings, target):
             link_target = f'{exe_branch}{suffix}'
             link_source = f'{rhs}{suffix}'
             if g_force or g_force is None:
-                os.system( f'cd {g_outdir} && ln -sf {link_target} {link_source}')
+                symlink_force( link_target, f'{g_outdir}/{link_source}')
             if g_verbose >= 0:
                 walk.log( f'{"Convenience link:":20s}{g_outdir}/{link_source} => {g_outdir}/{link_target}')
         make_link( '')
@@ -2694,15 +3718,21 @@ def build( timings, target):
 
 def get_args( argv):
     '''
-    Generator that iterates over `argv` items. Does getopt-style splitting of
-    args starting with single '-' character.
+    Returns iterator over `argv` items. Does getopt-style splitting of args
+    starting with single '-' character. All splitting is done up front.
+    
+    >>> list( get_args( ['-bv', '--build', 'foo', '-', '-j', '3']))
+    ['-b', '-v', '--build', 'foo', '-', '-j', '3']
     '''
+    ret = []
     for arg in argv:
-        if arg.startswith('-') and not arg.startswith('--'):
-            for arg2 in arg[1:]:
-                yield '-' + arg2
+        if not arg.startswith( '-') or arg.startswith( '--') or arg == '-':
+            # Common case: a value or long option, passed through unchanged.
+            ret.append( arg)
         else:
-            yield arg
+            # Cluster of short options such as `-bv`.
+            ret += [f'-{c}' for c in arg[1:]]
+    return iter( ret)
 
 
 def exception_info(
@@ -2868,7 +3898,7 @@ def exception_info(
     else:
         _, exception, tb = sys.exc_info()
         if not exception:
-            tb = inspect.stack()[1:]
+            tb = inspect.currentframe().f_back
 
     if file == 'return':
         out = io.StringIO()
@@ -2887,6 +3917,35 @@ def exception_info(
             out.write( '\nDuring handling of the above exception, another exception occurred:\n')
 
     cwd = os.getcwd() + os.sep
+    cwd_len = len( cwd)
+    dot_sep = f'.{os.sep}'
+
+    # We find frame information ourselves rather than with
+    # `inspect.getouterframes()` etc, because these read several lines of
+    # context for each frame. `linecache` caches file contents, so we only
+    # read each source file once.
+    #
+    def frame_info( frame, line):
+        code = frame.f_code
+        return code.co_filename, line, code.co_name
+
+    def outer_frames( frame, limit):
+        # With positive `limit` we only show the innermost `limit` frames,
+        # so don't look any further out.
+        ret = []
+        while frame:
+            if limit is not None and 0 < limit <= len( ret):
+                break
+            ret.append( frame_info( frame, frame.f_lineno))
+            frame = frame.f_back
+        return ret
+
+    def inner_frames( tb):
+        ret = []
+        while tb:
+            ret.append( frame_info( tb.tb_frame, tb.tb_lineno))
+            tb = tb.tb_next
+        return ret
 
     def output_frames( frames, reverse, limit):
         if reverse:
@@ -2894,12 +3953,12 @@ def exception_info(
         if limit is not None:
             frames = list( frames)
             frames = frames[ -limit:]
-        for frame in frames:
-            f, filename, line, fnname, text, index = frame
-            text = text[0].strip() if text else ''
-            if filename.startswith( cwd):
-                filename = filename[ len(cwd):]
-            if filename.startswith( f'.{os.sep}'):
+        for filename, line, fnname in frames:
+            text = linecache.getline( filename, line).strip() if line else ''
+            if filename[ :cwd_len] == cwd:
+                filename = filename[ cwd_len:]
+            if filename[ :2] == dot_sep:
+                # E.g. script was run as `./foo.py`, giving `<cwd>/./foo.py`.
                 filename = filename[ 2:]
             if _filelinefn:
                 out.write( f'    {filename}:{line}:{fnname}(): {text}\n')
@@ -2910,11 +3969,11 @@ def exception_info(
     if exception:
         tb = exception.__traceback__
         if outer:
-            output_frames( inspect.getouterframes( tb.tb_frame), reverse=True, limit=limit)
+            output_frames( outer_frames( tb.tb_frame, limit), reverse=True, limit=limit)
             out.write( '    ^except raise:\n')
-        output_frames( inspect.getinnerframes( tb), reverse=False, limit=None)
+        output_frames( inner_frames( tb), reverse=False, limit=None)
     else:
-        output_frames( tb, reverse=True, limit=limit)
+        output_frames( outer_frames( tb, limit), reverse=True, limit=limit)
 
     if exception:
         lines = traceback.format_exception_only( type(exception), exception)
@@ -2933,28 +3992,50 @@ def exception_info(
         return out.getvalue()
 
 
+# Options that take an integer value and simply set a global.
+_int_options = {
+        '--ccache':         'g_ccache',
+        '--clang':          'g_clang',
+        '--defines-header': 'g_defines_header',
+        '--fast-ls':        'g_fast_ls',
+        '--flags-all':      'g_flags_all',
+        '--fp':             'g_frame_pointer',
+        '--gperf':          'g_gperf',
+        '--hash':           'g_use_hash',
+        '--link-jobs':      'g_link_concurrency',
+        '--optimise':       'g_build_optimise',
+        '--pch':            'g_pch',
+        '--v-excludes':     'g_verbose_excludes',
+        }
+
+# Options that take no value and set a global to a fixed value.
+_flag_options = {
+        '-k':               ( 'g_keep_going', True),
+        '--link-only':      ( 'g_link_only', True),
+        '-n':               ( 'g_force', False),
+        '-t':               ( 'g_show_timings', True),
+        }
+
 def main():
 
+    # Tell walk.log() to use _log_prefix as prefix for each line. We do this
+    # here rather than at import time, so that importing this module does
+    # not change walk's global state.
+    walk.log_prefix_set( _log_prefix)
+    
     timings = Timings()
     
     global g_build_debug
-    global g_build_optimise
-    global g_clang
     global g_concurrency
     global g_verbose
     global g_force
-    global g_frame_pointer
-    global g_gperf
-    global g_keep_going
-    global g_link_only
+    global g_linker
     global g_max_load_average
     global g_osg
     global g_osg_dir
     global g_outdir
     global g_props_locking
-    global g_show_timings
     global g_walk_verbose
-    global g_verbose_excludes
     
     do_build = False
     target = 'fgfs'
@@ -2967,6 +4048,13 @@ def main():
         if 0:
             pass
         
+        elif arg in _int_options:
+            globals()[ _int_options[ arg]] = int( next( args))
+        
+        elif arg in _flag_options:
+            name, value = _flag_options[ arg]
+            globals()[ name] = value
+        
         elif arg == '-b' or arg == '--build':
             do_build = True
         
@@ -2985,8 +4073,6 @@ def main():
                                 walk.mtime( path)
                                 n += 1
             walk.log( f'n={n} t={time.time()-t}')
-        elif arg == '--clang':
-            g_clang = int( next( args))
         
         elif arg == '--convert-walk-all':
             root = next( args)
@@ -3010,9 +4096,6 @@ def main():
                     #report=True,
                     )
         
-        elif arg == '--flags-all':
-            g_flags_all = int( next( args))
-        
         elif arg == '--force':
             force = next( args)
             if force == 'default':
@@ -3020,44 +4103,34 @@ def main():
             else:
                 g_force = int( force)
         
-        elif arg == '--fp':
-            g_frame_pointer = int( next( args))
-        
-        elif arg == '--gperf':
-            g_gperf = int( next( args))
-        
         elif arg == '-h' or arg == '--help':
             print( __doc__)
         
         elif arg == '-j':
-            g_concurrency = abs(int( next( args)))
-            assert g_concurrency >= 0
-        
-        elif arg == '-k':
-            g_keep_going = True
+            concurrency = next( args)
+            if concurrency == 'auto':
+                g_concurrency = concurrency
+            else:
+                g_concurrency = abs(int( concurrency))
+                assert g_concurrency >= 0
         
         elif arg == '-l':
             g_max_load_average = float( next( args))
         
-        elif arg == '--link-only':
-            g_link_only = True
-        
-        elif arg == '-n':
-            g_force = False
+        elif arg == '--linker':
+            g_linker = next( args)
+            linkers = 'auto default mold lld gold'.split()
+            assert g_linker in linkers, \
+                f'unrecognised linker={g_linker} should be one of: {" ".join(linkers)}.'
         
         elif arg == '--new':
             path = next( args)
             walk.mtime_cache_mark_new( path)
         
         elif arg == '--old':
+            path = next( args)
             walk.mtime_cache_mark_old( path)
         
-        elif arg == '--optimise':
-            g_build_optimise = int( next( args))
-        
-        elif arg == '--optimise':
-            g_build_optimise = int( next( args))
-        
         elif arg == '--optimise-prefix':
             optimise = int( next( args))
             prefix = next( args)
@@ -3086,18 +4159,22 @@ def main():
         elif arg == '--show':
             print( f'concurrency:        {g_concurrency}')
             print( f'debug:              {g_build_debug}')
+            print( f'defines-header:     {g_defines_header}')
+            print( f'fast-ls:            {g_fast_ls}')
             print( f'force:              {("default" if g_force is None else g_force)}')
+            print( f'hash:               {g_use_hash}')
+            print( f'ccache:             {g_ccache}')
             print( f'clang:              {g_clang}')
+            print( f'link_jobs:          {g_link_concurrency}')
+            print( f'linker:             {g_linker}')
             print( f'max_load_average:   {g_max_load_average}')
             print( f'optimise:           {g_build_optimise}')
             print( f'osg:                {g_osg_dir}')
             print( f'outdir:             {g_outdir}')
+            print( f'pch:                {g_pch}')
             print( f'verbose:            {g_verbose}')
             print( f'walk-verbose:       {walk.get_verbose( g_walk_verbose)}')
         
-        elif arg == '-t':
-            g_show_timings = True
-        
         elif arg == '-o':
             target = next( args)
             targets = 'fgfs test-suite props-test yasim-test'.split()
@@ -3113,19 +4190,17 @@ def main():
         elif arg == '-v':
             g_verbose += 1
         
-        elif arg == '--v-excludes':
-            g_verbose_excludes = int( next( args))
-        
         elif arg == '-w':
             v = next( args)
-            if v.startswith( '+') or v.startswith( '-'):
+            if v.startswith( ( '+', '-')):
+                # Add or remove characters, preserving the order of existing
+                # characters.
                 vv = walk.get_verbose( g_walk_verbose)
-                for c in v[1:]:
-                    if v[0] == '+':
-                        if c not in vv:
-                            vv += c
-                    else:
-                        vv = vv.replace( c, '')
+                sign, chars = v[0], set( v[1:])
+                if sign == '+':
+                    vv += ''.join( c for c in dict.fromkeys( v[1:]) if c not in vv)
+                else:
+                    vv = ''.join( c for c in vv if c not in chars)
                 g_walk_verbose = vv
             else:
                 g_walk_verbose = v